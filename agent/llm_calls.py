@@ -0,0 +1,166 @@
+# llm_calls.py
+"""Adaptive timeouts and hedged requests for LLM calls.
+
+Each call gets a timeout derived from recently observed latencies. With
+hedging on, a duplicate request is sent once the primary has been running
+longer than the observed p95; whichever answer arrives first is used and
+the other is cancelled.
+
+Calls run as `model.ainvoke` tasks on one background event loop, so there
+is no worker cap to queue behind and losing/timed-out requests are really
+cancelled. Each call's task runs in a copy of the caller's context, which
+keeps LangSmith tracing attached to the calling node.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+import time
+from collections import deque
+
+
+class LatencyTracker:
+    """Sliding window of call latencies (seconds)."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, pct):
+        """Nearest-rank percentile, or None if nothing has been recorded."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        rank = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples))) - 1))
+        return samples[rank]
+
+
+class HedgedInvoker:
+    """Invoke a model with an adaptive timeout and optional hedging."""
+
+    def __init__(self, hedge=False, initial_timeout=30.0, min_timeout=2.0,
+                 max_timeout=60.0, timeout_multiplier=2.0, min_samples=20):
+        self.hedge = hedge
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.min_samples = min_samples
+        self.latencies = LatencyTracker()
+        self._loop = None
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0,
+            "hedges_fired": 0,
+            "hedge_wins": 0,
+            "timeouts": 0,
+            "errors": 0,
+        }
+
+    def timeout(self):
+        """Per-call timeout: p99 latency times a multiplier, clamped.
+
+        Until `min_samples` latencies are in, `initial_timeout` is used,
+        clamped the same way.
+        """
+        if len(self.latencies) < self.min_samples:
+            timeout = self.initial_timeout
+        else:
+            timeout = self.latencies.percentile(99) * self.timeout_multiplier
+        return max(self.min_timeout, min(self.max_timeout, timeout))
+
+    def hedge_delay(self):
+        """How long to wait on the primary before hedging (None = don't hedge)."""
+        if not self.hedge or len(self.latencies) < self.min_samples:
+            return None
+        return self.latencies.percentile(95)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever,
+                                 name="llm-calls", daemon=True).start()
+            return self._loop
+
+    def invoke(self, model, messages):
+        """Call `model.ainvoke(messages)`; raises TimeoutError past the deadline."""
+        self._count("calls")
+        start = time.monotonic()
+        loop = self._get_loop()
+        context = contextvars.copy_context()
+        result = concurrent.futures.Future()
+
+        def copy_outcome(task):
+            if task.cancelled():
+                result.cancel()
+            elif task.exception() is not None:
+                result.set_exception(task.exception())
+            else:
+                result.set_result(task.result())
+
+        def schedule():
+            task = loop.create_task(self._invoke(model, messages, start), context=context)
+            task.add_done_callback(copy_outcome)
+
+        loop.call_soon_threadsafe(schedule)
+        return result.result()
+
+    async def _invoke(self, model, messages, start):
+        timeout = self.timeout()
+        hedge_after = self.hedge_delay()
+        deadline = start + timeout
+
+        primary = asyncio.create_task(model.ainvoke(messages))
+        pending = {primary}
+        try:
+            if hedge_after is not None and hedge_after < timeout:
+                done, _ = await asyncio.wait(pending, timeout=start + hedge_after - time.monotonic())
+                if not done:
+                    self._count("hedges_fired")
+                    pending.add(asyncio.create_task(model.ainvoke(messages)))
+
+            last_error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0, deadline - time.monotonic()),
+                    return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    # Latency as the caller saw it, including any wait before hedging
+                    self.latencies.record(time.monotonic() - start)
+                    if task is not primary:
+                        self._count("hedge_wins")
+                    return task.result()
+
+            if last_error is not None and not pending:
+                self._count("errors")
+                raise last_error
+
+            self._count("timeouts")
+            # Record the timeout so the window adapts upward after slow periods
+            self.latencies.record(time.monotonic() - start)
+            raise TimeoutError(f"LLM call timed out after {timeout:.1f}s")
+        finally:
+            for task in pending:
+                task.cancel()
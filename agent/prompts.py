@@ -0,0 +1,155 @@
+# prompts.py
+"""Versioned prompt templates and memoized context blocks.
+
+Templates are parsed once at import time, so rendering is a join over
+precomputed pieces. PROMPT_VERSION identifies the full template set and is
+recorded with each run.
+
+The analysis prompts are what actually goes to OpenAI; they are static and
+sent as the leading system message, so their prefix never changes between
+calls. PromptCacheStats tracks how many of those prompt tokens the provider
+served from its cache (OpenAI only caches prompts of 1024+ tokens).
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from string import Formatter
+
+
+class PromptTemplate:
+    """A named, versioned template compiled once from str.format syntax."""
+
+    def __init__(self, name, version, text):
+        self.name = name
+        self.version = version
+        self.text = text
+        self._parts = []
+        for literal, field, spec, conversion in Formatter().parse(text):
+            if spec or conversion:
+                raise ValueError(f"Template {name} only supports plain {{field}} placeholders")
+            self._parts.append((literal, field))
+        self.fields = frozenset(field for _, field in self._parts if field)
+
+    @property
+    def id(self):
+        return f"{self.name}@{self.version}"
+
+    def render(self, **values):
+        missing = self.fields - values.keys()
+        if missing:
+            raise ValueError(f"Missing {', '.join(sorted(missing))} for template {self.id}")
+        return "".join(
+            literal + (str(values[field]) if field else "")
+            for literal, field in self._parts
+        )
+
+
+CONCIERGE_SYSTEM = PromptTemplate("concierge_system", "v1", """You are an AI concierge helping customers connect with vendors for their projects.
+Generate a follow-up message based on the customer's response.
+Be friendly and professional.
+
+{customer_block}
+{task_block}
+{vendor_block}""")
+
+GREETING = PromptTemplate("greeting", "v1", """Congratulations on your new {category} Task! I'm here to assist you. We have found an excellent vendor, {vendor_name}, to perform this task. Can you reach out to them today or tomorrow?""")
+
+SENTIMENT_ANALYSIS = PromptTemplate("sentiment_analysis", "v1", """Analyze the following customer message and determine if the sentiment is positive or negative.
+Reply with ONLY ONE WORD - either 'positive' or 'negative'.""")
+
+REASON_ANALYSIS = PromptTemplate("reason_analysis", "v1", """The customer has expressed a negative sentiment. 
+Analyze their message and identify the specific concern or reason for their negative sentiment.
+Respond with ONLY the main concern in 3-5 words, with no additional explanation.
+Examples of good responses: 'budget constraints', 'timeline issues', 'quality concerns'""")
+
+TEMPLATES = {t.name: t for t in (CONCIERGE_SYSTEM, GREETING, SENTIMENT_ANALYSIS, REASON_ANALYSIS)}
+
+PROMPT_VERSION = ",".join(t.id for t in TEMPLATES.values())
+
+
+def render_context_block(label, data):
+    return f"{label} details: {json.dumps(data, indent=2)}"
+
+
+_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+class ContextBlockCache:
+    """LRU cache of rendered context blocks, keyed by their content."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._blocks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _content_key(data):
+        # The key must tell apart anything that renders differently, including
+        # 1/True/1.0/-0.0 and key order. Flat dicts of scalars (the usual case)
+        # key on (key, repr(value)) in order; anything else on a hash of its JSON
+        if all(type(k) is str and type(v) in _SCALAR_TYPES for k, v in data.items()):
+            return tuple((k, repr(v)) for k, v in data.items())
+        content = json.dumps(data, separators=(",", ":"))
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def render(self, label, data):
+        key = (label, self._content_key(data))
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return block
+            self.misses += 1
+        block = render_context_block(label, data)
+        with self._lock:
+            self._blocks[key] = block
+            while len(self._blocks) > self.max_entries:
+                self._blocks.popitem(last=False)
+        return block
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+CONTEXT_BLOCKS = ContextBlockCache()
+
+
+def render_concierge_prompt(customer, task, vendor):
+    """Render the concierge system prompt.
+
+    Vendor and task blocks repeat across runs and come from the cache;
+    customer blocks are mostly unique, so they are rendered directly.
+    """
+    return CONCIERGE_SYSTEM.render(
+        customer_block=render_context_block("Customer", customer),
+        task_block=CONTEXT_BLOCKS.render("Task", task),
+        vendor_block=CONTEXT_BLOCKS.render("Vendor", vendor),
+    )
+
+
+class PromptCacheStats:
+    """Provider-side prompt cache usage, from LLM response token counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, response):
+        usage = getattr(response, "usage_metadata", None) or {}
+        cached = (usage.get("input_token_details") or {}).get("cache_read", 0)
+        with self._lock:
+            self.prompt_tokens += usage.get("input_tokens", 0)
+            self.cached_tokens += cached or 0
+
+    def hit_rate(self):
+        with self._lock:
+            return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+
+PROMPT_CACHE = PromptCacheStats()
@@ -0,0 +1,477 @@
+# result_store.py
+"""Append-only columnar store for workflow run results.
+
+Each writer appends rows to its own JSON-lines log, so they are durable
+and visible to other processes immediately. Once the log reaches
+`segment_rows` rows or `seal_interval` seconds (or on flush) it is sealed
+into a columnar segment with the same base name and the log is removed.
+Low-cardinality columns (sentiment, reason, category, vendor, zip code) are
+dictionary-encoded, so group-by queries only touch small integer arrays
+instead of re-parsing formatted output.
+
+Segment file layout: one JSON header line, followed by the raw column bytes
+in the order given by the header's "layout" list.
+
+Logs are locked (flock) by their writer; a log nobody holds belongs to a
+writer that died, and is sealed by the next ResultStore opened on the
+directory.
+
+Hourly seals and process exits leave many small segments, so every
+`compact_every` seals the writer merges all segments below `segment_rows`
+into one (`compact()` can also be called directly). A merged segment lists
+the segments it replaces in its header; readers skip those until they are
+deleted.
+"""
+import fcntl
+import json
+import operator
+import os
+import threading
+import time
+import uuid
+from array import array
+from collections import Counter
+from itertools import compress
+
+SEGMENT_SUFFIX = ".seg"
+LOG_SUFFIX = ".log"
+COMPACT_LOCK = "compact.lock"
+
+# Dictionary-encoded columns, stored as integer codes per segment
+DICT_COLUMNS = ("sentiment", "reason", "category", "vendor", "zip_code", "prompt_version")
+# Plain string columns (high cardinality, only read when asked for)
+STRING_COLUMNS = ("customer_email", "vendor_email", "customer_name")
+# Numeric columns and their array typecodes
+NUMERIC_COLUMNS = {"timestamp": "d", "message_count": "I"}
+
+COLUMNS = DICT_COLUMNS + STRING_COLUMNS + tuple(NUMERIC_COLUMNS)
+
+
+def _code_typecode(dictionary_size):
+    """Pick the smallest unsigned typecode that fits the dictionary codes."""
+    if dictionary_size <= 0xFF:
+        return "B"
+    if dictionary_size <= 0xFFFF:
+        return "H"
+    return "I"
+
+
+def row_from_state(state, result=None):
+    """Build a store row from the structured workflow state.
+
+    Uses the customer/task/vendor dicts directly rather than the formatted
+    `project_summary` string.
+    """
+    result = result or {}
+    customer = state.get("customer", {})
+    task = state.get("task", {})
+    vendor = state.get("vendor", {})
+    messages = result.get("messages", state.get("messages", []))
+    return {
+        "sentiment": state.get("sentiment", ""),
+        "reason": state.get("reason", ""),
+        "category": task.get("category", ""),
+        "vendor": vendor.get("name", ""),
+        "zip_code": customer.get("zipCode", ""),
+        "prompt_version": state.get("prompt_version", ""),
+        "customer_email": customer.get("email", ""),
+        "vendor_email": vendor.get("email", ""),
+        "customer_name": customer.get("name", ""),
+        "timestamp": time.time(),
+        "message_count": len(messages),
+    }
+
+
+class _ActiveSegment:
+    """Mutable, in-memory segment that rows are appended to."""
+
+    def __init__(self):
+        self.rows = 0
+        self.dicts = {col: {} for col in DICT_COLUMNS}
+        self.codes = {col: array("I") for col in DICT_COLUMNS}
+        self.strings = {col: [] for col in STRING_COLUMNS}
+        self.numbers = {col: array(tc) for col, tc in NUMERIC_COLUMNS.items()}
+
+    def append(self, row):
+        for col in DICT_COLUMNS:
+            value = str(row.get(col) or "")
+            mapping = self.dicts[col]
+            code = mapping.get(value)
+            if code is None:
+                code = mapping[value] = len(mapping)
+            self.codes[col].append(code)
+        for col in STRING_COLUMNS:
+            self.strings[col].append(str(row.get(col) or ""))
+        for col in NUMERIC_COLUMNS:
+            self.numbers[col].append(row.get(col) or 0)
+        self.rows += 1
+
+    def dictionary(self, col):
+        # Codes are assigned in insertion order, so the dict order is the code order
+        return list(self.dicts[col])
+
+    def column(self, col):
+        if col in DICT_COLUMNS:
+            return self.codes[col]
+        if col in STRING_COLUMNS:
+            return self.strings[col]
+        return self.numbers[col]
+
+    def extend(self, segment):
+        """Append all rows of another segment, re-mapping dictionary codes."""
+        for col in DICT_COLUMNS:
+            mapping = self.dicts[col]
+            remap = []
+            for value in segment.dictionary(col):
+                code = mapping.get(value)
+                if code is None:
+                    code = mapping[value] = len(mapping)
+                remap.append(code)
+            self.codes[col].extend(map(remap.__getitem__, segment.column(col)))
+        for col in STRING_COLUMNS:
+            self.strings[col].extend(segment.column(col))
+        for col in NUMERIC_COLUMNS:
+            self.numbers[col].extend(segment.column(col))
+        self.rows += segment.rows
+
+    def close(self):
+        pass
+
+    def write(self, path, replaces=None):
+        """Seal this segment to `path` (written to a temp file, then renamed)."""
+        layout = []
+        blobs = []
+        dicts = {}
+        for col in DICT_COLUMNS:
+            dicts[col] = self.dictionary(col)
+            codes = array(_code_typecode(len(dicts[col])), self.codes[col])
+            blobs.append(codes.tobytes())
+            layout.append([col, codes.typecode, len(blobs[-1])])
+        for col in STRING_COLUMNS:
+            blobs.append(json.dumps(self.strings[col]).encode("utf-8"))
+            layout.append([col, "json", len(blobs[-1])])
+        for col in NUMERIC_COLUMNS:
+            blobs.append(self.numbers[col].tobytes())
+            layout.append([col, self.numbers[col].typecode, len(blobs[-1])])
+
+        header = {"rows": self.rows, "dicts": dicts, "layout": layout}
+        if replaces:
+            header["replaces"] = replaces
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, path)
+
+
+class _SealedSegment:
+    """Read-only view of a segment file; columns are loaded on demand.
+
+    The file stays open until close(), so columns can still be read if
+    compaction deletes the segment mid-query.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.base = os.path.basename(path)[:-len(SEGMENT_SUFFIX)]
+        self._file = open(path, "rb")
+        header_line = self._file.readline()
+        header = json.loads(header_line)
+        self.rows = header["rows"]
+        self.replaces = header.get("replaces", [])
+        self._dicts = header["dicts"]
+        self._offsets = {}
+        offset = len(header_line)
+        for col, typecode, size in header["layout"]:
+            self._offsets[col] = (offset, typecode, size)
+            offset += size
+
+    def dictionary(self, col):
+        # Columns added after this segment was written read as all-empty
+        return self._dicts.get(col, [""])
+
+    def column(self, col):
+        if col not in self._offsets:
+            return array("B", bytes(self.rows))
+        offset, typecode, size = self._offsets[col]
+        self._file.seek(offset)
+        data = self._file.read(size)
+        if typecode == "json":
+            return json.loads(data)
+        values = array(typecode)
+        values.frombytes(data)
+        return values
+
+    def close(self):
+        self._file.close()
+
+
+def _read_log(path):
+    """Load a row log into an in-memory segment (a torn last line is skipped)."""
+    segment = _ActiveSegment()
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                segment.append(json.loads(line))
+            except ValueError:
+                continue
+    return segment
+
+
+class ResultStore:
+    """Append-only, segment-based columnar store for run results."""
+
+    def __init__(self, directory, segment_rows=8192, seal_interval=3600.0,
+                 compact_every=16):
+        self.directory = directory
+        self.segment_rows = segment_rows
+        self.seal_interval = seal_interval
+        self.compact_every = compact_every
+        self._seals_since_compact = 0
+        self._lock = threading.Lock()
+        self._active = _ActiveSegment()
+        self._log_fd = None
+        self._log_base = None
+        self._log_opened_at = 0.0
+        os.makedirs(directory, exist_ok=True)
+        self._recover_orphaned_logs()
+
+    def append(self, row):
+        """Append one result row (see `row_from_state`)."""
+        line = (json.dumps(row, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            if self._log_fd is None:
+                self._open_log()
+            os.write(self._log_fd, line)
+            self._active.append(row)
+            if (self._active.rows >= self.segment_rows
+                    or time.monotonic() - self._log_opened_at >= self.seal_interval):
+                self._seal()
+
+    def append_state(self, state, result=None):
+        self.append(row_from_state(state, result))
+
+    def flush(self):
+        """Seal the current log into a segment, if it has any rows."""
+        with self._lock:
+            if self._active.rows:
+                self._seal()
+
+    def _path(self, base, suffix):
+        return os.path.join(self.directory, base + suffix)
+
+    @staticmethod
+    def _new_base():
+        return f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+
+    def _open_log(self):
+        # Lock under a temp name, then rename: recovery must never see an
+        # unlocked .log that a live writer is about to use
+        self._log_base = self._new_base()
+        tmp_path = self._path(self._log_base, LOG_SUFFIX + ".tmp")
+        self._log_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+        fcntl.flock(self._log_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(tmp_path, self._path(self._log_base, LOG_SUFFIX))
+        self._log_opened_at = time.monotonic()
+
+    def _seal(self):
+        # The segment appears (atomically) before the log goes away, and
+        # readers ignore a log whose segment already exists
+        self._active.write(self._path(self._log_base, SEGMENT_SUFFIX))
+        os.unlink(self._path(self._log_base, LOG_SUFFIX))
+        os.close(self._log_fd)
+        self._log_fd = None
+        self._log_base = None
+        self._active = _ActiveSegment()
+        self._seals_since_compact += 1
+        if self._seals_since_compact >= self.compact_every:
+            self.compact()
+
+    def _open_sealed(self, names):
+        """Open segment headers, dropping segments replaced by a merged one."""
+        segments = []
+        try:
+            for name in names:
+                if name.endswith(SEGMENT_SUFFIX):
+                    segments.append(_SealedSegment(os.path.join(self.directory, name)))
+        except BaseException:
+            for segment in segments:
+                segment.close()
+            raise
+        replaced = {base for segment in segments for base in segment.replaces}
+        live = []
+        for segment in segments:
+            if segment.base in replaced:
+                segment.close()
+            else:
+                live.append(segment)
+        return live, replaced
+
+    def compact(self):
+        """Merge all sealed segments smaller than `segment_rows` into one.
+
+        Returns the number of segments merged. Only one process compacts a
+        directory at a time; others return 0 straight away.
+        """
+        lock_fd = os.open(os.path.join(self.directory, COMPACT_LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            self._seals_since_compact = 0
+            segments, replaced = self._open_sealed(sorted(os.listdir(self.directory)))
+            # Finish deleting segments left behind by an interrupted compaction
+            for base in replaced:
+                if os.path.exists(self._path(base, SEGMENT_SUFFIX)):
+                    os.unlink(self._path(base, SEGMENT_SUFFIX))
+            small = [s for s in segments if s.rows < self.segment_rows]
+            for segment in segments:
+                if segment not in small:
+                    segment.close()
+            try:
+                if len(small) < 2:
+                    return 0
+                merged = _ActiveSegment()
+                for segment in small:
+                    merged.extend(segment)
+                merged.write(self._path(self._new_base(), SEGMENT_SUFFIX),
+                             replaces=[s.base for s in small])
+            finally:
+                for segment in small:
+                    segment.close()
+            for segment in small:
+                os.unlink(segment.path)
+            return len(small)
+        finally:
+            os.close(lock_fd)
+
+    def _recover_orphaned_logs(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(LOG_SUFFIX):
+                continue
+            base = name[:-len(LOG_SUFFIX)]
+            try:
+                fd = os.open(self._path(base, LOG_SUFFIX), os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)  # Live writer
+                continue
+            try:
+                if not os.path.exists(self._path(base, LOG_SUFFIX)):
+                    continue  # Recovered by someone else meanwhile
+                if not os.path.exists(self._path(base, SEGMENT_SUFFIX)):
+                    segment = _read_log(self._path(base, LOG_SUFFIX))
+                    if segment.rows:
+                        segment.write(self._path(base, SEGMENT_SUFFIX))
+                os.unlink(self._path(base, LOG_SUFFIX))
+            finally:
+                os.close(fd)
+
+    def _segments(self, attempts=5):
+        """Consistent list of segments, logs and our own unsealed rows.
+
+        A file can be sealed or compacted away between listing the directory
+        and opening it; the listing is then retried.
+        """
+        for attempt in range(attempts):
+            # List under the lock so our own seal can't land between the
+            # listing and the snapshot (which would count those rows twice)
+            with self._lock:
+                own_base = self._log_base
+                snapshot = _ActiveSnapshot(self._active) if self._active.rows else None
+                names = sorted(os.listdir(self.directory))
+            segments = []
+            try:
+                segments, replaced = self._open_sealed(names)
+                sealed = {s.base for s in segments} | replaced
+                for name in names:
+                    if name.endswith(LOG_SUFFIX):
+                        base = name[:-len(LOG_SUFFIX)]
+                        if base not in sealed and base != own_base:
+                            segments.append(_read_log(self._path(base, LOG_SUFFIX)))
+            except FileNotFoundError:
+                for segment in segments:
+                    segment.close()
+                if attempt == attempts - 1:
+                    raise
+                continue
+            if snapshot:
+                segments.append(snapshot)
+            return segments
+
+    def count(self, where=None):
+        """Number of rows matching `where` ({dict column: value})."""
+        return sum(self.group_by(where=where).values())
+
+    def group_by(self, *columns, where=None):
+        """Count rows grouped by dictionary-encoded `columns`.
+
+        Returns a Counter keyed by tuples of decoded values (an empty tuple
+        when no columns are given). `where` filters on exact values of
+        dictionary-encoded columns.
+        """
+        where = where or {}
+        for col in list(columns) + list(where):
+            if col not in DICT_COLUMNS:
+                raise ValueError(f"Can only group/filter on {DICT_COLUMNS}, got {col}")
+
+        totals = Counter()
+        segments = self._segments()
+        try:
+            self._count_segments(segments, columns, where, totals)
+        finally:
+            for segment in segments:
+                segment.close()
+        return totals
+
+    @staticmethod
+    def _count_segments(segments, columns, where, totals):
+        for segment in segments:
+            mask = None
+            for col, value in where.items():
+                dictionary = segment.dictionary(col)
+                if value not in dictionary:
+                    break
+                # Row mask built with C-level map()s rather than a per-row generator
+                matches = map(dictionary.index(value).__eq__, segment.column(col))
+                mask = matches if mask is None else map(operator.and_, mask, matches)
+            else:
+                key_columns = [segment.column(col) for col in columns]
+                if mask is not None:
+                    if key_columns:
+                        counts = Counter(compress(zip(*key_columns), mask))
+                    else:
+                        counts = Counter({(): sum(mask)})
+                elif key_columns:
+                    counts = Counter(zip(*key_columns))
+                else:
+                    counts = Counter({(): segment.rows})
+                # Decode once per distinct key, not once per row
+                dictionaries = [segment.dictionary(col) for col in columns]
+                for key, n in counts.items():
+                    decoded = tuple(d[code] for d, code in zip(dictionaries, key))
+                    totals[decoded] += n
+
+
+class _ActiveSnapshot:
+    """Point-in-time copy of the active segment used while querying."""
+
+    def __init__(self, active):
+        self.rows = active.rows
+        self._dicts = {col: active.dictionary(col) for col in DICT_COLUMNS}
+        self._active = active
+
+    def dictionary(self, col):
+        return self._dicts[col]
+
+    def column(self, col):
+        # Columns only ever grow, so slicing to the snapshot length is stable
+        return self._active.column(col)[:self.rows]
+
+    def close(self):
+        pass
@@ -0,0 +1,152 @@
+# single_flight.py
+"""Coalesce duplicate workflow submissions.
+
+Concurrent calls with the same key share one in-flight run; once it
+finishes, its result is returned for repeats within an idempotency window.
+
+`do()` wraps a callable. When the run spans several graph nodes, use
+`join()` at the start and `publish()` at the end instead: the first caller
+becomes the leader, later ones wait for what it publishes. A leader that
+never publishes (its run failed) holds the key for at most `lease` seconds,
+after which a waiting caller takes over. Failures are never cached.
+"""
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def canonical_key(payload):
+    """Stable hash of a JSON-serializable payload (key order doesn't matter)."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def submission_key(state, exclude=()):
+    """Key for a workflow submission: the whole input state.
+
+    Messages are reduced to type and content, since their ids are assigned
+    per run; everything else is hashed as is.
+    """
+    payload = {k: v for k, v in state.items() if k not in exclude and k != "messages"}
+    payload["messages"] = [
+        {"type": m.get("type"), "content": m.get("content")} if isinstance(m, dict)
+        else {"type": getattr(m, "type", None), "content": getattr(m, "content", None)}
+        for m in state.get("messages", [])
+    ]
+    return canonical_key(payload)
+
+
+class _Call:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Single-flight execution with a short-lived result cache."""
+
+    def __init__(self, ttl=30.0, max_entries=1024, lease=300.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._results = OrderedDict()  # key -> (finished_at, result)
+        self._counters = {"runs": 0, "coalesced": 0, "cache_hits": 0}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def _cached(self, key):
+        # Caller holds self._lock
+        cached = self._results.get(key)
+        if cached is None:
+            return False, None
+        finished_at, result = cached
+        if time.monotonic() - finished_at > self.ttl:
+            del self._results[key]
+            return False, None
+        self._results.move_to_end(key)
+        self._counters["cache_hits"] += 1
+        return True, copy.deepcopy(result)
+
+    def _store(self, key, result):
+        # Caller holds self._lock
+        self._results[key] = (time.monotonic(), result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    def do(self, key, fn):
+        """Return fn()'s result, running it at most once per key at a time."""
+        with self._lock:
+            hit, result = self._cached(key)
+            if hit:
+                return result
+
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+                self._counters["runs"] += 1
+            else:
+                self._counters["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                if call.error is None:
+                    self._store(key, call.result)
+            call.done.set()
+        return copy.deepcopy(call.result)
+
+    def join(self, key):
+        """Start or join the run for `key`.
+
+        Returns (True, result) with a copy of a cached or shared result, or
+        (False, None) when the caller is now the leader and must call
+        `publish(key, result)` once its run is done.
+        """
+        while True:
+            with self._lock:
+                hit, result = self._cached(key)
+                if hit:
+                    return True, result
+                call = self._inflight.get(key)
+                if (call is None or call.done.is_set()
+                        or time.monotonic() - call.started > self.lease):
+                    self._inflight[key] = _Call()
+                    self._counters["runs"] += 1
+                    return False, None
+                self._counters["coalesced"] += 1
+
+            call.done.wait(max(0, call.started + self.lease - time.monotonic()))
+            if call.done.is_set() and call.error is None:
+                return True, copy.deepcopy(call.result)
+            # The leader failed or its lease ran out: try again (and likely lead)
+
+    def publish(self, key, result):
+        """Share a leader's result with waiting callers and cache it."""
+        with self._lock:
+            self._store(key, result)
+            call = self._inflight.pop(key, None)
+        if call is not None:
+            call.result = result
+            call.done.set()
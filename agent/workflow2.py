@@ -5,7 +5,6 @@ from typing import TypedDict, Dict, Any, List, Annotated
 from langgraph.graph import StateGraph, END
 import os
 from langsmith.run_helpers import traceable
-import json
 import random
 from datetime import datetime
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage
@@ -13,6 +12,15 @@ from langgraph.graph import add_messages
 from functools import lru_cache
 from langchain_openai import ChatOpenAI
 import openai
+import atexit
+import sys
+# Allow sibling modules to be imported when loaded by file path (langgraph.json)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from result_store import ResultStore
+from llm_calls import HedgedInvoker
+from single_flight import SingleFlight, submission_key
+from prompts import (GREETING, SENTIMENT_ANALYSIS, REASON_ANALYSIS, PROMPT_VERSION,
+                     PROMPT_CACHE, render_concierge_prompt)
 # Set environment variables for local LangGraph tracing
 #os.environ["LANGCHAIN_TRACING_V2"] = "true"
 #os.environ["LANGCHAIN_PROJECT"] = "prizm-workflow-2"
@@ -31,6 +39,30 @@ OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
 MOCK_USER_RESPONSES = os.environ.get("MOCK_USER_RESPONSES", "False").lower() == "true"
 MOCK_SENTIMENT_ANALYSIS = os.environ.get("MOCK_SENTIMENT_ANALYSIS", "False").lower() == "true"
 
+# Optional columnar store for run results (used by the analytics dashboards)
+RESULT_STORE_DIR = os.environ.get("RESULT_STORE_DIR")
+RESULT_STORE = ResultStore(RESULT_STORE_DIR) if RESULT_STORE_DIR else None
+if RESULT_STORE:
+    atexit.register(RESULT_STORE.flush)
+
+# Adaptive per-call timeouts for LLM calls, optionally hedged past the p95 latency
+LLM_HEDGING = os.environ.get("LLM_HEDGING", "False").lower() == "true"
+LLM_MAX_TIMEOUT = float(os.environ.get("LLM_MAX_TIMEOUT", "60"))
+LLM_INVOKER = HedgedInvoker(hedge=LLM_HEDGING, max_timeout=LLM_MAX_TIMEOUT)
+
+# Identical submissions share one run; repeats within this window (seconds)
+# reuse the earlier result
+IDEMPOTENCY_WINDOW = float(os.environ.get("IDEMPOTENCY_WINDOW", "30"))
+SUBMISSIONS = SingleFlight(ttl=IDEMPOTENCY_WINDOW)
+
+# State fields a coalesced duplicate takes over from the run it joined
+SHARED_FIELDS = ["summary", "sentiment", "reason", "current_step",
+                 "sentiment_attempts", "prompt_version"]
+
+# Analysis prompts are static, so build the system messages once and reuse them
+SENTIMENT_SYSTEM_MESSAGE = SystemMessage(content=SENTIMENT_ANALYSIS.render())
+REASON_SYSTEM_MESSAGE = SystemMessage(content=REASON_ANALYSIS.render())
+
 # Global variables to control mocking behavior
 #MOCK_USER_RESPONSES = os.environ["MOCK_USER_RESPONSES"]  # Set to False for real user interaction
 #MOCK_SENTIMENT_ANALYSIS = os.environ["MOCK_SENTIMENT_ANALYSIS"]  # Set to False for real LLM sentiment analysis
@@ -59,12 +91,16 @@ class WorkflowState(TypedDict):
     reason: str  # For storing sentiment reason
     current_step: str  # For tracking workflow progress
     sentiment_attempts: int  # For tracking sentiment analysis attempts
+    prompt_version: str  # Prompt template set used for this run
+    submission: dict  # Coalescing key and whether this run reused another's result
 
 # Step 1: Initialize Models (from your example)
 @lru_cache(maxsize=4)
 def _get_model(model_name: str, system_prompt: str = None):
     if model_name == "openai":
-        model = ChatOpenAI(temperature=0, model_name="gpt-4o")
+        # Per-attempt timeout; LLM_INVOKER cancels the whole call (retries
+        # included) at its own adaptive deadline
+        model = ChatOpenAI(temperature=0, model_name="gpt-4o", timeout=LLM_MAX_TIMEOUT)
     else:
         raise ValueError(f"Unsupported model type: {model_name}")
     
@@ -76,20 +112,23 @@ def _get_model(model_name: str, system_prompt: str = None):
     return model
 
 # 2. Node Implementations
-@traceable(project_name="prizm-workflow-2")
-def validate_input(state: WorkflowState):
-    required_fields = {
-        "customer": ["name", "email", "phoneNumber", "zipCode"],
-        "task": ["description", "category"],
-        "vendor": ["name", "email", "phoneNumber"]
-    }
-    
-    for section, fields in required_fields.items():
-        if section not in state:
+REQUIRED_FIELDS = {
+    "customer": ["name", "email", "phoneNumber", "zipCode"],
+    "task": ["description", "category"],
+    "vendor": ["name", "email", "phoneNumber"]
+}
+
+def check_required_fields(data):
+    for section, fields in REQUIRED_FIELDS.items():
+        if section not in data:
             raise ValueError(f"Missing {section} data")
         for field in fields:
-            if field not in state[section]:
+            if field not in data[section]:
                 raise ValueError(f"Missing {field} in {section}")
+
+@traceable(project_name="prizm-workflow-2")
+def validate_input(state: WorkflowState):
+    check_required_fields(state)
     
     # Initialize workflow tracking fields if not present
     if "current_step" not in state:
@@ -122,16 +161,10 @@ def generate_initial_prompt(state: WorkflowState):
     vendor = state["vendor"]
     
     # Construct the greeting message
-    greeting = f"""Congratulations on your new {task['category']} Task! I'm here to assist you. We have found an excellent vendor, {vendor['name']}, to perform this task. Can you reach out to them today or tomorrow?"""
+    greeting = GREETING.render(category=task['category'], vendor_name=vendor['name'])
     
-    # Add the greeting as a system message
-    system_prompt = f"""You are an AI concierge helping customers connect with vendors for their projects.
-Generate a follow-up message based on the customer's response.
-Be friendly and professional.
-
-Customer details: {json.dumps(customer, indent=2)}
-Task details: {json.dumps(task, indent=2)}
-Vendor details: {json.dumps(vendor, indent=2)}"""
+    # Add the greeting as a system message (context blocks are cached by content)
+    system_prompt = render_concierge_prompt(customer, task, vendor)
     
     # Add the messages
     messages = [
@@ -141,7 +174,8 @@ Vendor details: {json.dumps(vendor, indent=2)}"""
     
     return {
         "messages": messages,
-        "current_step": "analyze_sentiment"
+        "current_step": "analyze_sentiment",
+        "prompt_version": PROMPT_VERSION
     }
 
 #################
@@ -247,18 +281,15 @@ def analyze_sentiment(state: WorkflowState):
             # Use real OpenAI for sentiment analysis - SIMPLIFIED APPROACH
             print("Calling OpenAI for sentiment analysis...")
             
-            # First, determine only positive/negative sentiment
-            sentiment_prompt = """Analyze the following customer message and determine if the sentiment is positive or negative.
-Reply with ONLY ONE WORD - either 'positive' or 'negative'."""
-            
             model = _get_model("openai")
             
             # First call - just to determine positive/negative
             try:
-                sentiment_analysis = model.invoke([
-                    SystemMessage(content=sentiment_prompt),
+                sentiment_analysis = LLM_INVOKER.invoke(model, [
+                    SENTIMENT_SYSTEM_MESSAGE,
                     last_human_message
                 ])
+                PROMPT_CACHE.record(sentiment_analysis)
                 
                 sentiment_text = sentiment_analysis.content.strip().lower()
                 print(f"OpenAI sentiment response: '{sentiment_text}'")
@@ -273,16 +304,12 @@ Reply with ONLY ONE WORD - either 'positive' or 'negative'."""
                     
                     # Second call - specifically to extract the reason
                     print("Making second call to extract reason...")
-                    reason_prompt = """The customer has expressed a negative sentiment. 
-Analyze their message and identify the specific concern or reason for their negative sentiment.
-Respond with ONLY the main concern in 3-5 words, with no additional explanation.
-Examples of good responses: 'budget constraints', 'timeline issues', 'quality concerns'"""
-                    
                     try:
-                        reason_analysis = model.invoke([
-                            SystemMessage(content=reason_prompt),
+                        reason_analysis = LLM_INVOKER.invoke(model, [
+                            REASON_SYSTEM_MESSAGE,
                             last_human_message
                         ])
+                        PROMPT_CACHE.record(reason_analysis)
                         
                         extracted_reason = reason_analysis.content.strip()
                         print(f"Extracted reason: '{extracted_reason}'")
@@ -406,6 +433,45 @@ def process_data(state: WorkflowState):
         "summary": summary
     }
 
+@traceable(project_name="prizm-workflow-2")
+def coalesce_submission(state: WorkflowState):
+    """Share one run between identical submissions.
+
+    The key covers the whole validated input, including the conversation so
+    far. The first submission runs the pipeline; duplicates wait for it (or
+    hit the cache) and take over its results instead of re-running it.
+    """
+    key = submission_key(state, exclude=["submission"])
+    shared, result = SUBMISSIONS.join(key)
+    if not shared:
+        return {"submission": {"key": key, "shared": False,
+                               "message_count": len(state.get("messages", []))}}
+    
+    print(f"Reusing result of an identical submission ({SUBMISSIONS.stats()})")
+    # The shared messages are copies; drop their ids so they're added to
+    # this thread's conversation as new messages
+    for message in result["messages"]:
+        message.id = None
+    return {**result, "submission": {"key": key, "shared": True}}
+
+def route_submission(state: WorkflowState):
+    if state.get("submission", {}).get("shared"):
+        return END
+    return "initialize_state"
+
+@traceable(project_name="prizm-workflow-2")
+def publish_submission(state: WorkflowState):
+    """Hand this run's results to identical submissions waiting on it."""
+    submission = state.get("submission", {})
+    messages = state.get("messages", [])
+    SUBMISSIONS.publish(submission["key"], {
+        **{field: state.get(field) for field in SHARED_FIELDS if field in state},
+        # Only the messages this run added; the input ones are already
+        # in every duplicate's state
+        "messages": messages[submission["message_count"]:],
+    })
+    return {"submission": submission}
+
 # Add this function to convert message objects to serializable dictionaries
 def messages_to_dict(messages):
     """Convert message objects to serializable dictionaries."""
@@ -421,16 +487,13 @@ def messages_to_dict(messages):
             result.append(message)
     return result
 
-@traceable(project_name="prizm-workflow-2")
-def format_output(state: WorkflowState):
-    # Log what's coming in
-    print(f"format_output received sentiment={state.get('sentiment', '')}, reason={state.get('reason', '')}")
-    
+def format_result(state):
+    """Build the serializable run output from a workflow state."""
     # Convert message objects to serializable dictionaries
     messages_dict = messages_to_dict(state.get("messages", []))
     
     # Ensure all values are present
-    result = {
+    return {
         "customer_email": state.get("customer", {}).get("email"),
         "vendor_email": state.get("vendor", {}).get("email"),
         "project_summary": state.get("summary", ""),
@@ -438,6 +501,17 @@ def format_output(state: WorkflowState):
         "reason": state.get("reason", ""),
         "messages": messages_dict
     }
+
+@traceable(project_name="prizm-workflow-2")
+def format_output(state: WorkflowState):
+    # Log what's coming in
+    print(f"format_output received sentiment={state.get('sentiment', '')}, reason={state.get('reason', '')}")
+    
+    result = format_result(state)
+    
+    # Record structured fields (not the formatted summary) for analytics
+    if RESULT_STORE:
+        RESULT_STORE.append_state(state, result)
     
     # Log what's going out
     print(f"format_output returning sentiment={result['sentiment']}, reason={result['reason']}")
@@ -447,20 +521,24 @@ def format_output(state: WorkflowState):
 # 3. Graph Setup
 workflow = StateGraph(WorkflowState)
 workflow.add_node("validate", validate_input)
+workflow.add_node("coalesce", coalesce_submission)
 workflow.add_node("initialize_state", initialize_state)
 workflow.add_node("generate_initial_prompt", generate_initial_prompt)
 workflow.add_node("analyze_sentiment", analyze_sentiment)
 workflow.add_node("process_sentiment", process_sentiment)
 workflow.add_node("process", process_data)
+workflow.add_node("publish", publish_submission)
 workflow.add_node("format", format_output)
 
 # Add edges
-workflow.add_edge("validate", "initialize_state")
+workflow.add_edge("validate", "coalesce")
+workflow.add_conditional_edges("coalesce", route_submission, ["initialize_state", END])
 workflow.add_edge("initialize_state", "generate_initial_prompt")
 workflow.add_edge("generate_initial_prompt", "analyze_sentiment")
 workflow.add_edge("analyze_sentiment", "process_sentiment")
 workflow.add_edge("process_sentiment", "process")
-workflow.add_edge("process", "format")
+workflow.add_edge("process", "publish")
+workflow.add_edge("publish", "format")
 workflow.add_edge("format", END)
 
 workflow.set_entry_point("validate")
@@ -491,6 +569,7 @@ if __name__ == "__main__":
     print("Starting workflow execution...")
     print(f"Mock user responses: {'ON' if MOCK_USER_RESPONSES else 'OFF'}")
     print(f"Mock sentiment analysis: {'ON' if MOCK_SENTIMENT_ANALYSIS else 'OFF'}")
+    print(f"LLM hedging: {'ON' if LLM_HEDGING else 'OFF'}")
     
     result = app.invoke(input_data)
     
@@ -513,5 +592,8 @@ if __name__ == "__main__":
         else:
             print(f"- Unknown message format: {type(msg)}")
     
+    print(f"\nLLM call stats: {LLM_INVOKER.stats()}")
+    print(f"Prompt cache: {PROMPT_CACHE.cached_tokens}/{PROMPT_CACHE.prompt_tokens} prompt tokens cached ({PROMPT_CACHE.hit_rate():.1%})")
+    
     print("\nWorkflow execution complete. You can view the trace in the LangGraph UI.")
     print("Visit: https://smith.langchain.com/studio/?baseUrl=http://127.0.0.1:2024")
\ No newline at end of file
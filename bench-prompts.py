@@ -0,0 +1,78 @@
+"""
+Benchmark prompt rendering: inline f-string + json.dumps (old generate_initial_prompt)
+vs. compiled templates with cached context blocks, plus the context block
+cache hit rate.
+
+Provider-side prompt cache hits can't be simulated here: they come from the
+`cached_tokens` OpenAI reports, which workflow2 collects in PROMPT_CACHE and
+prints at the end of a run (OpenAI only caches prompts of 1024+ tokens).
+
+poetry run python bench-prompts.py
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent"))
+from prompts import CONTEXT_BLOCKS, PROMPT_VERSION, render_concierge_prompt
+
+RUNS = 50000
+VENDORS = 200
+TASKS = 50
+CUSTOMERS = 20000
+
+
+def make_workload():
+    random.seed(0)
+    vendors = [
+        {"name": f"Vendor {i}", "email": f"vendor{i}@example.com", "phoneNumber": f"555-000-{i:04d}"}
+        for i in range(VENDORS)
+    ]
+    tasks = [
+        {"description": f"Task {i}", "category": random.choice(["Remodeling", "Plumbing", "Roofing"])}
+        for i in range(TASKS)
+    ]
+    customers = [
+        {"name": f"Customer {i}", "email": f"customer{i}@example.com",
+         "phoneNumber": f"555-100-{i:04d}", "zipCode": f"94{i % 1000:03d}"}
+        for i in range(CUSTOMERS)
+    ]
+    return [
+        (random.choice(customers), random.choice(tasks), random.choice(vendors))
+        for _ in range(RUNS)
+    ]
+
+
+def inline_prompt(customer, task, vendor):
+    return f"""You are an AI concierge helping customers connect with vendors for their projects.
+Generate a follow-up message based on the customer's response.
+Be friendly and professional.
+
+Customer details: {json.dumps(customer, indent=2)}
+Task details: {json.dumps(task, indent=2)}
+Vendor details: {json.dumps(vendor, indent=2)}"""
+
+
+def main():
+    workload = make_workload()
+
+    start = time.perf_counter()
+    inline = [inline_prompt(c, t, v) for c, t, v in workload]
+    inline_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    templated = [render_concierge_prompt(c, t, v) for c, t, v in workload]
+    templated_time = time.perf_counter() - start
+
+    assert templated == inline, "template output differs from the inline prompt"
+    print(f"Templates: {PROMPT_VERSION}")
+    print(f"Runs: {RUNS} ({VENDORS} vendors, {TASKS} tasks, {CUSTOMERS} customers)")
+    print(f"Inline render:    {inline_time / RUNS * 1e6:.1f} us/prompt")
+    print(f"Template render:  {templated_time / RUNS * 1e6:.1f} us/prompt")
+    print(f"Context block cache hit rate: {CONTEXT_BLOCKS.hit_rate():.1%}")
+
+
+if __name__ == "__main__":
+    main()
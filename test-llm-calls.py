@@ -0,0 +1,122 @@
+"""
+Checks for agent/llm_calls.py using fake async models (no OpenAI calls):
+- concurrent calls don't queue behind each other and time out
+- the caller's contextvars (LangSmith tracing) are visible inside the call
+- a hedge win records the latency the caller saw and cancels the loser
+- a timeout raises TimeoutError and cancels the request
+- the warm-up timeout respects min_timeout/max_timeout
+
+poetry run python test-llm-calls.py
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent"))
+from llm_calls import HedgedInvoker
+
+TRACE = contextvars.ContextVar("trace", default=None)
+
+
+class FakeModel:
+    """ainvoke sleeps for the next delay in `delays` (the last one repeats)."""
+
+    def __init__(self, delays):
+        self.delays = list(delays)
+        self.calls = 0
+        self.cancelled = 0
+        self.seen_trace = []
+
+    async def ainvoke(self, messages):
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        self.seen_trace.append(TRACE.get())
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"slept {delay}"
+
+
+def test_no_queueing():
+    invoker = HedgedInvoker(initial_timeout=1.5)
+    model = FakeModel([1.0])
+    errors = []
+
+    def call():
+        try:
+            invoker.invoke(model, [])
+        except TimeoutError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, f"{len(errors)} calls timed out"
+
+
+def test_context_propagates():
+    invoker = HedgedInvoker()
+    model = FakeModel([0.01])
+    TRACE.set("parent-run")
+    invoker.invoke(model, [])
+    assert model.seen_trace == ["parent-run"], model.seen_trace
+
+
+def test_hedge_latency_and_cancel():
+    invoker = HedgedInvoker(hedge=True, min_samples=1, min_timeout=0.1)
+    invoker.latencies.record(0.2)
+    # Primary hangs, hedge (sent after ~0.2s) answers in 0.05s
+    model = FakeModel([5.0, 0.05])
+    start = time.monotonic()
+    assert invoker.invoke(model, []) == "slept 0.05"
+    elapsed = time.monotonic() - start
+    stats = invoker.stats()
+    assert stats["hedges_fired"] == 1 and stats["hedge_wins"] == 1, stats
+    recorded = invoker.latencies.percentile(100)
+    assert 0.24 <= recorded <= elapsed, (recorded, elapsed)
+    time.sleep(0.05)
+    assert model.cancelled == 1, model.cancelled
+
+
+def test_timeout_cancels():
+    invoker = HedgedInvoker(initial_timeout=0.2)
+    model = FakeModel([5.0])
+    try:
+        invoker.invoke(model, [])
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError("expected TimeoutError")
+    time.sleep(0.05)
+    assert model.cancelled == 1
+    assert invoker.stats()["timeouts"] == 1
+
+
+def test_timeout_clamped_during_warmup():
+    # workflow2 only passes max_timeout; the default initial_timeout is higher
+    invoker = HedgedInvoker(max_timeout=10)
+    assert invoker.timeout() == 10
+    assert HedgedInvoker(initial_timeout=0.5, min_timeout=2.0).timeout() == 2.0
+    invoker = HedgedInvoker(initial_timeout=0.2, min_timeout=0.1, max_timeout=0.2)
+    model = FakeModel([5.0])
+    start = time.monotonic()
+    try:
+        invoker.invoke(model, [])
+    except TimeoutError:
+        pass
+    assert time.monotonic() - start < 1.0
+
+
+if __name__ == "__main__":
+    for test in (test_no_queueing, test_context_propagates,
+                 test_hedge_latency_and_cancel, test_timeout_cancels,
+                 test_timeout_clamped_during_warmup):
+        test()
+        print(f"{test.__name__}: ok")
@@ -0,0 +1,176 @@
+"""
+Checks for agent/result_store.py (no OpenAI/LangGraph needed):
+- rows are visible to another process's store before any flush
+- a writer killed mid-log is recovered by the next store on the directory
+- filtered and unfiltered group-bys agree across sealed and unsealed rows
+- small segments are compacted without losing or double-counting rows
+- recovery running alongside writers never takes a live writer's log
+
+poetry run python test-result-store.py
+"""
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+AGENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent")
+sys.path.append(AGENT_DIR)
+from result_store import ResultStore
+
+SENTIMENTS = ["positive", "negative", "unknown"]
+CATEGORIES = ["Remodeling", "Plumbing", "Roofing"]
+
+
+def make_row(i):
+    return {
+        "sentiment": SENTIMENTS[i % 3],
+        "reason": "budget concerns" if i % 3 == 1 else "",
+        "category": CATEGORIES[i % 7 % 3],
+        "vendor": f"Vendor {i % 50}",
+        "zip_code": f"94{i % 100:03d}",
+        "customer_email": f"c{i}@example.com",
+        "timestamp": time.time(),
+        "message_count": 3,
+    }
+
+
+def test_visible_across_stores():
+    directory = tempfile.mkdtemp()
+    writer = ResultStore(directory, segment_rows=1000)
+    for i in range(2500):
+        writer.append(make_row(i))
+    reader = ResultStore(directory)
+    assert reader.count() == 2500, reader.count()
+    writer.flush()
+    assert reader.count() == 2500, reader.count()
+    assert not [n for n in os.listdir(directory) if n.endswith(".log")]
+
+
+def test_recovers_killed_writer():
+    directory = tempfile.mkdtemp()
+    child = subprocess.Popen([sys.executable, "-c", f"""
+import sys, time
+sys.path.append({AGENT_DIR!r})
+from result_store import ResultStore
+store = ResultStore({directory!r})
+for i in range(300):
+    store.append({{"sentiment": "positive", "vendor": "V"}})
+print("ready", flush=True)
+time.sleep(60)
+"""], stdout=subprocess.PIPE, text=True)
+    assert child.stdout.readline().strip() == "ready"
+    # While the writer is alive its log is locked and left alone
+    assert ResultStore(directory).count() == 300
+    assert [n for n in os.listdir(directory) if n.endswith(".log")]
+    child.send_signal(signal.SIGKILL)
+    child.wait()
+    store = ResultStore(directory)
+    assert store.count(where={"vendor": "V"}) == 300
+    assert not [n for n in os.listdir(directory) if n.endswith(".log")]
+
+
+def test_filtered_group_by():
+    directory = tempfile.mkdtemp()
+    store = ResultStore(directory, segment_rows=50000)
+    rows = [make_row(i) for i in range(120000)]
+    for row in rows:
+        store.append(row)
+
+    where = {"category": "Plumbing", "sentiment": "negative"}
+    expected = {}
+    for row in rows:
+        if all(row[k] == v for k, v in where.items()):
+            key = (row["vendor"],)
+            expected[key] = expected.get(key, 0) + 1
+
+    start = time.perf_counter()
+    filtered = store.group_by("vendor", where=where)
+    filtered_time = time.perf_counter() - start
+    start = time.perf_counter()
+    store.group_by("vendor")
+    unfiltered_time = time.perf_counter() - start
+
+    assert dict(filtered) == expected
+    assert store.count(where=where) == sum(expected.values())
+    assert store.count(where={"vendor": "nobody"}) == 0
+    print(f"  group_by over {len(rows)} rows: filtered {filtered_time:.3f}s, "
+          f"unfiltered {unfiltered_time:.3f}s")
+
+
+def segment_files(directory):
+    return [n for n in os.listdir(directory) if n.endswith(".seg")]
+
+
+def test_compaction():
+    directory = tempfile.mkdtemp()
+    store = ResultStore(directory, segment_rows=100, compact_every=4)
+    for i in range(30):
+        # One small segment per "restart"
+        store.append(make_row(i))
+        store.flush()
+    expected = store.group_by("vendor", "sentiment")
+    assert sum(expected.values()) == 30
+    assert len(segment_files(directory)) < 8, segment_files(directory)
+
+    # An interrupted compaction leaves the merged segment and its inputs
+    # behind; readers must count those rows once and the next compaction
+    # must clean up
+    for i in range(3):
+        store.append(make_row(i))
+        store.flush()
+    before = set(segment_files(directory))
+    store.compact()
+    merged = (set(segment_files(directory)) - before).pop()
+    with open(os.path.join(directory, merged), "rb") as f:
+        replaced = json.loads(f.readline())["replaces"]
+    for base in replaced:
+        # Put the inputs back as if the deletes never happened
+        with open(os.path.join(directory, base + ".seg"), "wb") as f:
+            f.write(open(os.path.join(directory, merged), "rb").read())
+    assert store.count() == 33, store.count()
+    store.compact()
+    assert store.count() == 33
+    assert not set(replaced) & {n[:-4] for n in segment_files(directory)}
+
+
+def test_recovery_races_writers():
+    directory = tempfile.mkdtemp()
+    errors = []
+    per_writer = 200
+
+    def writer():
+        try:
+            store = ResultStore(directory, segment_rows=7)
+            for i in range(per_writer):
+                store.append(make_row(i))
+        except Exception as e:
+            errors.append(e)
+
+    def recoverer():
+        try:
+            for _ in range(200):
+                ResultStore(directory)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer) for _ in range(4)]
+    threads += [threading.Thread(target=recoverer) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+    assert ResultStore(directory).count() == 4 * per_writer
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    for test in (test_visible_across_stores, test_recovers_killed_writer, test_filtered_group_by,
+                 test_compaction, test_recovery_races_writers):
+        test()
+        print(f"{test.__name__}: ok")
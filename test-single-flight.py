@@ -0,0 +1,157 @@
+"""
+Checks for agent/single_flight.py (used by workflow2's coalesce and publish nodes):
+- concurrent identical submissions share one run
+- repeats inside the idempotency window hit the cache, later ones re-run
+- failures reach every waiting caller but aren't cached
+- the key ignores dict key order
+- submissions with the same customer/task/vendor but different messages
+  don't coalesce; message ids don't affect the key
+- join/publish: waiting duplicates get the leader's result, and a leader
+  that never publishes is taken over after its lease
+
+poetry run python test-single-flight.py
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent"))
+from single_flight import SingleFlight, canonical_key, submission_key
+
+PAYLOAD = {
+    "customer": {"name": "John Smith", "zipCode": "94105"},
+    "task": {"description": "Kitchen renovation", "category": "Remodeling"},
+    "vendor": {"name": "Bay Area Remodelers"},
+}
+
+
+def run_concurrently(n, fn):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(fn())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def test_coalesces_and_caches():
+    flight = SingleFlight(ttl=0.3)
+    runs = []
+
+    def pipeline():
+        runs.append(1)
+        time.sleep(0.1)
+        return {"sentiment": "positive"}
+
+    key = canonical_key(PAYLOAD)
+    results, errors = run_concurrently(10, lambda: flight.do(key, pipeline))
+    assert not errors and len(runs) == 1
+    assert all(r == {"sentiment": "positive"} for r in results)
+    # Callers get their own copies
+    results[0]["sentiment"] = "changed"
+    assert flight.do(key, pipeline) == {"sentiment": "positive"}
+    assert len(runs) == 1
+    time.sleep(0.35)
+    flight.do(key, pipeline)
+    assert len(runs) == 2
+    assert flight.stats() == {"runs": 2, "coalesced": 9, "cache_hits": 1}, flight.stats()
+
+
+def test_errors_shared_not_cached():
+    flight = SingleFlight()
+    runs = []
+
+    def failing():
+        runs.append(1)
+        time.sleep(0.1)
+        raise ValueError("OpenAI unavailable")
+
+    results, errors = run_concurrently(5, lambda: flight.do("k", failing))
+    assert not results and len(errors) == 5 and len(runs) == 1
+    assert flight.do("k", lambda: "ok") == "ok"
+
+
+def test_canonical_key():
+    reordered = {
+        "vendor": {"name": "Bay Area Remodelers"},
+        "task": {"category": "Remodeling", "description": "Kitchen renovation"},
+        "customer": {"zipCode": "94105", "name": "John Smith"},
+    }
+    assert canonical_key(PAYLOAD) == canonical_key(reordered)
+    assert canonical_key(PAYLOAD) != canonical_key({**PAYLOAD, "vendor": {"name": "Other"}})
+
+
+class Message:
+    """Stand-in for a langchain message (type, content and a per-run id)."""
+
+    def __init__(self, type, content, id):
+        self.type = type
+        self.content = content
+        self.id = id
+
+
+def test_submission_key_covers_messages():
+    budget = {**PAYLOAD, "messages": [Message("human", "Too expensive for me.", "a")]}
+    happy = {**PAYLOAD, "messages": [Message("human", "Yes, I'll call them!", "b")]}
+    assert submission_key(budget) != submission_key(happy)
+    assert submission_key(budget) != submission_key(PAYLOAD)
+    # Same conversation, different ids (or plain dicts) -> same submission
+    same = {**PAYLOAD, "messages": [Message("human", "Too expensive for me.", "c")]}
+    as_dicts = {**PAYLOAD, "messages": [{"type": "human", "content": "Too expensive for me."}]}
+    assert submission_key(budget) == submission_key(same) == submission_key(as_dicts)
+    assert submission_key({**budget, "submission": {"key": "x"}}, exclude=["submission"]) \
+        == submission_key(budget)
+
+    # Different replies each run (and get) their own result
+    flight = SingleFlight()
+    assert flight.join(submission_key(budget)) == (False, None)
+    assert flight.join(submission_key(happy)) == (False, None)
+    flight.publish(submission_key(budget), {"sentiment": "negative"})
+    flight.publish(submission_key(happy), {"sentiment": "positive"})
+    assert flight.join(submission_key(happy)) == (True, {"sentiment": "positive"})
+
+
+def test_join_publish():
+    flight = SingleFlight(ttl=30)
+    key = submission_key(PAYLOAD)
+    assert flight.join(key) == (False, None)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.join(key))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    # Nobody has published yet, so the duplicates are still waiting
+    assert not results
+    flight.publish(key, {"sentiment": "positive"})
+    for t in threads:
+        t.join()
+    assert results == [(True, {"sentiment": "positive"})] * 5
+    assert flight.stats()["runs"] == 1
+
+
+def test_join_lease_takeover():
+    flight = SingleFlight(lease=0.2)
+    key = submission_key(PAYLOAD)
+    assert flight.join(key) == (False, None)  # This leader never publishes
+    start = time.monotonic()
+    assert flight.join(key) == (False, None)
+    assert time.monotonic() - start >= 0.2
+    flight.publish(key, "done")
+    assert flight.join(key) == (True, "done")
+
+
+if __name__ == "__main__":
+    for test in (test_coalesces_and_caches, test_errors_shared_not_cached, test_canonical_key,
+                 test_submission_key_covers_messages, test_join_publish, test_join_lease_takeover):
+        test()
+        print(f"{test.__name__}: ok")